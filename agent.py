@@ -1,29 +1,395 @@
 import asyncio
+import atexit
+import functools
 import json
 import logging
 import os
+import queue
 import random
 import sqlite3
+import sys
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import replace
 from datetime import date, datetime
-from logging.handlers import TimedRotatingFileHandler
-from typing import Optional, List, Dict, Any
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, BinaryIO, ClassVar, Dict, Iterator, List, Optional, Set, Union
 
+import anthropic
 import openai
+from anthropic.types.beta import BetaMessageParam
 from dotenv import load_dotenv
-from pydantic_ai import Agent, capture_run_messages
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.mcp import MCPServerStdio
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    UserPromptPart,
+)
+from pydantic_ai.models import Model
 from pydantic_ai.models.anthropic import AnthropicModel
 from pydantic_ai.models.fallback import FallbackModel
-from pydantic_ai.models.gemini import GeminiModel
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.mcp import MCPServerStdio
-from pydantic_ai.messages import TextPart, ToolCallPart
-from pydantic_core import to_jsonable_python
+from pydantic_ai.models.wrapper import WrapperModel
 
 from coding_agent import CodingAgent
 
+# Per-connection PRAGMAs applied to every SQLite connection to the task database.
+SQLITE_PRAGMAS = [
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    # Wait for other processes (e.g. the Slack bot and the web UI) instead of failing
+    "PRAGMA busy_timeout=5000",
+]
+
+# Number of read-only connections used for SELECTs alongside the single writer connection.
+READ_POOL_SIZE = 4
+
+# Bump when init_db gains new migrations; stored in the database as PRAGMA user_version.
+SCHEMA_VERSION = 4
+
+# Columns added to the tasks table after its first release, with their definitions.
+TASK_COLUMN_MIGRATIONS = [
+    ("due", "TEXT DEFAULT ''"),
+    ("tags", "TEXT DEFAULT ''"),
+    ("recurrence", "TEXT DEFAULT ''"),
+    ("points", "INT DEFAULT 1"),
+]
+
+# Secondary indexes on the tasks table, created by the schema migration.
+TASK_INDEXES = [
+    # Superseded by idx_tasks_pending; the planner preferred it and then sorted in a temp b-tree
+    "DROP INDEX IF EXISTS idx_tasks_open",
+    # Open tasks in PENDING_TASKS_QUERY order, so the system prompt is read without a sort.
+    # Only open tasks are indexed, which keeps the index small as completed tasks pile up.
+    "CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks(time_added DESC) "
+    "WHERE time_complete IS NULL",
+    # Due-date filters and sorts ("overdue", "due this week") seek instead of scanning
+    "CREATE INDEX IF NOT EXISTS idx_tasks_due ON tasks(due)",
+]
+
+# At most this many pending tasks are listed in the system prompt; every row costs tokens.
+PENDING_TASKS_LIMIT = 100
+
+# Fixed SQL text for the pending-tasks system prompt, so the statement is prepared once
+# and then served from the connection's statement cache. One row past the limit is fetched
+# to tell whether there are more pending tasks than are listed.
+PENDING_TASKS_QUERY = (
+    "SELECT id, description, time_added, due, tags, recurrence FROM tasks "
+    f"WHERE time_complete IS NULL ORDER BY time_added DESC LIMIT {PENDING_TASKS_LIMIT + 1}"
+)
+
+# HTTP status codes from a model provider that are worth retrying on the next model in the
+# fallback chain: timeouts, rate limits, server errors and Anthropic's 529 "overloaded".
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504, 529}
+
+# Seconds to wait for a single model request before giving up and trying the next model.
+MODEL_REQUEST_TIMEOUT = 90
+
+# A model's circuit opens after this many retryable failures within the window (seconds),
+# and stays open for the reset timeout before a single probe request is let through.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_FAILURE_WINDOW = 60
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Conversation history is dropped after this many seconds without a new message.
+HISTORY_TTL = 3600
+
+# Conversation history kept between turns is trimmed to about this many messages, and to
+# about this many characters of message content (roughly 6000 tokens).
+MAX_HISTORY_MESSAGES = 40
+MAX_HISTORY_CHARS = 24000
+
+# Flush buffered notebook notes early if a single turn produces this many.
+NOTES_BATCH_SIZE = 500
+
+# Coding agent updates are collected and posted to Slack once this many seconds have passed
+# since the last post, or earlier if their text grows past the character limit. Slack
+# accepts at most 50 blocks per message.
+CODING_UPDATE_FLUSH_INTERVAL = 0.75
+CODING_UPDATE_MAX_CHARS = 2500
+SLACK_MAX_BLOCKS = 50
+
+# Coding requests waiting for the coding agent worker; further requests are turned away.
+CODING_QUEUE_SIZE = 4
+
+# A coding request is abandoned after this many seconds, so a hung stream can't block the
+# worker and the queue behind it.
+CODING_QUERY_TIMEOUT = 900
+
+# Slack emoji for each tool, and for query_task_database by SQL statement type.
+TOOL_EMOJI = {
+    "write_notes_to_notebook": "memo",  # Memo for notebook operations
+    "call_coding_agent": "robot_face",  # Robot for coding agent
+}
+SQL_EMOJI = {
+    "SELECT": "mag",  # Magnifying glass for SELECT
+    "INSERT": "heavy_plus_sign",  # Plus for INSERT
+    "UPDATE": "pencil",  # Pencil for UPDATE
+    "DELETE": "wastebasket",  # Trash for DELETE
+}
+
+
+class ProviderDown(Exception):
+    """
+    Raised instead of calling a model whose circuit breaker is open.
+    """
+
+
+class CircuitBreakerModel(WrapperModel):
+    """
+    Wraps a model and stops calling it for a while once it keeps failing, so the fallback chain
+    moves on straight away instead of waiting for another timeout or 5xx from a provider that
+    is known to be down.
+
+    Closed: requests go through, and retryable failures are recorded.
+    Open: requests raise ProviderDown without touching the network.
+    Half-open: after the reset timeout one probe request is let through, and its outcome
+    closes or reopens the circuit.
+    """
+
+    def __init__(
+        self,
+        wrapped: Model,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        failure_window: float = CIRCUIT_FAILURE_WINDOW,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        super().__init__(wrapped)
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self._failures = deque()
+        self._opened_at = None
+        self._probing = False
+
+    async def request(self, *args: Any, **kwargs: Any) -> ModelResponse:
+        probe = False
+        if self._opened_at is not None:
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise ProviderDown(f"{self.model_name} is unavailable, skipping it")
+            probe = self._probing = True
+
+        try:
+            response = await self.wrapped.request(*args, **kwargs)
+        except Exception as exc:
+            if _should_fall_back(exc):
+                self._record_failure()
+            elif probe:
+                # The provider answered, just not successfully, so it is back up
+                self._close()
+            raise
+        finally:
+            if probe:
+                self._probing = False
+        self._close()
+        return response
+
+    def _record_failure(self) -> None:
+        now = time.monotonic()
+        if self._opened_at is not None:
+            # A failed probe keeps the circuit open for another reset timeout
+            self._opened_at = now
+            return
+        self._failures.append(now)
+        while self._failures and now - self._failures[0] > self.failure_window:
+            self._failures.popleft()
+        if len(self._failures) >= self.failure_threshold:
+            self._opened_at = now
+
+    def _close(self) -> None:
+        self._failures.clear()
+        self._opened_at = None
+
+
+class CachingAnthropicModel(AnthropicModel):
+    """
+    Anthropic model that marks the system prompt for prompt caching. The system prompt is built
+    once at the start of a conversation and carried in the history, so it is identical on every
+    request of that conversation; caching it (together with the tool definitions, which come
+    before it) makes later requests bill those tokens at the cache-read rate.
+    """
+
+    async def _map_message(
+        self, messages: List[ModelMessage]
+    ) -> tuple[Union[str, List[Dict[str, Any]]], List[BetaMessageParam]]:
+        # pydantic-ai has no cache_control setting yet, so send the system prompt as a single
+        # text block carrying the cache breakpoint instead of a plain string.
+        system_prompt, anthropic_messages = await super()._map_message(messages)
+        if system_prompt:
+            system_prompt = [
+                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}
+            ]
+        return system_prompt, anthropic_messages
+
+
+def _should_fall_back(exc: Exception) -> bool:
+    """
+    Decide whether a failed model request should be retried on the next model in the chain.
+    Errors in the request itself, like a bad request or invalid credentials, are raised right
+    away instead of being repeated against every model.
+    """
+    if isinstance(exc, ProviderDown):
+        return True
+    if isinstance(exc, ModelHTTPError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (anthropic.APIConnectionError, openai.APIConnectionError))
+
+
+def _message_chars(msg: ModelMessage) -> int:
+    """
+    Rough size of a message in characters: the text content and tool call arguments of its
+    parts. Used as a cheap stand-in for its token count (about four characters per token).
+    System prompt parts are left out, since trimming always carries them over.
+    """
+    size = 0
+    for part in getattr(msg, "parts", ()):
+        if isinstance(part, SystemPromptPart):
+            continue
+        content = getattr(part, "content", None)
+        if content:
+            size += len(content) if isinstance(content, str) else len(str(content))
+        args = getattr(part, "args", None)
+        if args:
+            size += len(args) if isinstance(args, str) else len(json.dumps(args))
+    return size
+
+
+def _trim_history(
+    messages: List[ModelMessage],
+    max_messages: int = MAX_HISTORY_MESSAGES,
+    max_chars: int = MAX_HISTORY_CHARS,
+) -> List[ModelMessage]:
+    """
+    Drop the oldest turns of a conversation so at most max_messages messages and about
+    max_chars characters are kept; if even the last turn is larger, only that turn is kept.
+    The cut is made at a user prompt, so tool calls are never separated from their returns,
+    and the system prompt parts of the first request are carried over to the new first
+    message since pydantic-ai does not regenerate them when there is history.
+    """
+    sizes = [_message_chars(msg) for msg in messages]
+    remaining = sum(sizes)
+    if len(messages) <= max_messages and remaining <= max_chars:
+        return messages
+
+    start = None
+    for i, msg in enumerate(messages):
+        if i > 0 and isinstance(msg, ModelRequest) and any(
+            isinstance(part, UserPromptPart) for part in msg.parts
+        ):
+            start = i
+            if len(messages) - i <= max_messages and remaining <= max_chars:
+                break
+        remaining -= sizes[i]
+    if start is None:
+        # A single turn can't be cut safely
+        return messages
+
+    system_parts = []
+    if isinstance(messages[0], ModelRequest):
+        system_parts = [part for part in messages[0].parts if isinstance(part, SystemPromptPart)]
+    first = replace(messages[start], parts=[*system_parts, *messages[start].parts])
+    return [first, *messages[start + 1 :]]
+
+
+def _format_value(value: Any) -> str:
+    """
+    Render a single value of a result row. Strings containing tabs or line breaks are quoted
+    with repr(), so they can't be mistaken for extra columns or rows.
+    """
+    if isinstance(value, str) and ("\t" in value or "\n" in value or "\r" in value):
+        return repr(value)
+    return str(value)
+
+
+def _format_rows(rows: List[tuple]) -> str:
+    """
+    Render query result rows for the model as tab-separated values, one row per line. This is
+    shorter than the tuple repr (no parentheses, and quotes only where a value needs them)
+    and cheaper to build.
+    """
+    return "\n".join(["\t".join(map(_format_value, row)) for row in rows])
+
+
+def _tool_call_emoji(part: ToolCallPart) -> str:
+    """
+    Choose the Slack emoji shown for a tool call.
+
+    Args:
+        part: The tool call made by the agent.
+    Returns:
+        str: The emoji name.
+    """
+    if part.tool_name != "query_task_database" or not part.has_content():
+        return TOOL_EMOJI.get(part.tool_name, "gear")
+
+    # The SQL is in the 'query' argument; models send arguments as a dict or a JSON string
+    args = part.args
+    if isinstance(args, str) and args.lstrip().startswith("{"):
+        try:
+            args = json.loads(args)
+        except ValueError:
+            pass
+    query = args.get("query", "") if isinstance(args, dict) else args
+    # All statement types with a dedicated emoji are six letters long
+    return SQL_EMOJI.get(str(query).lstrip()[:6].upper(), "card_index_dividers")
+
+
+def _text_elements(part: TextPart) -> List[Dict]:
+    """
+    Slack rich text elements for a text part; empty parts are left out.
+    """
+    if not part.has_content():
+        return []
+    return [{"type": "text", "text": part.content + "\n"}]
+
+
+def _tool_call_elements(part: ToolCallPart) -> List[Dict]:
+    """
+    Slack rich text elements for a tool call: an emoji followed by the tool name.
+    """
+    return [
+        {"type": "emoji", "name": _tool_call_emoji(part)},
+        {"type": "text", "text": f" Called {part.tool_name}\n"},
+    ]
+
+
+# Builders for the message parts shown in Slack, looked up by exact part type.
+_PART_ELEMENTS = {
+    TextPart: _text_elements,
+    ToolCallPart: _tool_call_elements,
+}
+
+
+def _message_block(msg: ModelMessage) -> Dict:
+    """
+    Build the Slack rich text block for one agent message. Parts without a builder, such as
+    tool returns, are skipped.
+    """
+    elements = [
+        element
+        for part in msg.parts
+        if type(part) in _PART_ELEMENTS
+        for element in _PART_ELEMENTS[type(part)](part)
+    ]
+    return {
+        "type": "rich_text",
+        "elements": [{"type": "rich_text_section", "elements": elements}],
+    }
+
 
 class MorpheusBot:
+    # Absolute paths of the log and notes directories already created by this process.
+    _created_dirs: ClassVar[Set[str]] = set()
+
     def __init__(
         self,
         db_filename: str = "tasks.db",
@@ -34,10 +400,19 @@ class MorpheusBot:
         self.log_dir = "logs"
         self.notes_dir = "notes"
         self.notebook_filename = notebook_filename
+        self.system_prompt = system_prompt
+        # Notes written by the agent during a turn, appended to the notebook in one go.
+        self._pending_notes = []
+        # Notebook prompt as ((mtime_ns, size), prompt), reused until the file changes on disk.
+        self._notes_cache = None
 
-        # Ensure the required directories exist
-        for d in [self.log_dir, self.notes_dir]:
-            os.makedirs(d, exist_ok=True)
+        # Ensure the required directories exist. The paths are relative to the working
+        # directory, so remember them as absolute paths and create each one only once.
+        for d in (self.log_dir, self.notes_dir):
+            path = os.path.abspath(d)
+            if path not in MorpheusBot._created_dirs:
+                os.makedirs(path, exist_ok=True)
+                MorpheusBot._created_dirs.add(path)
 
         # Set up the audit logger
         self.audit_logger = logging.getLogger("auditlog")
@@ -45,13 +420,19 @@ class MorpheusBot:
         # Avoid adding duplicate handlers if the logger already has them.
         if not self.audit_logger.handlers:
             audit_handler = TimedRotatingFileHandler(
-                f"{self.log_dir}/auditlog.log", when="midnight", interval=1
+                f"{self.log_dir}/auditlog.log", when="midnight", interval=1, delay=True
             )
             audit_handler.suffix = "%Y-%m-%d"
             audit_handler.setFormatter(
                 logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
             )
-            self.audit_logger.addHandler(audit_handler)
+            # Queue records and let a background thread write them, so logging
+            # never blocks the request path on disk I/O.
+            log_queue = queue.Queue(-1)
+            self.audit_logger.addHandler(QueueHandler(log_queue))
+            listener = QueueListener(log_queue, audit_handler)
+            listener.start()
+            atexit.register(listener.stop)
 
         load_dotenv()
         # Validate that required environment variables are present.
@@ -62,13 +443,76 @@ class MorpheusBot:
                 f"Missing required environment variables: {', '.join(missing_vars)}"
             )
 
+        # Message log entries are queued and appended by a background thread, so a turn never
+        # waits on the write. Today's log stays open and is reopened when the date changes.
+        self._msg_log_date = None
+        self._msg_log_fh = None
+        self._msg_log_queue = queue.Queue()
+        self._msg_log_writer = threading.Thread(
+            target=self._message_log_worker, name="message-log", daemon=True
+        )
+        self._msg_log_writer.start()
+
+        # Slack channel for coding agent updates, passed to morpheus.py as --channel.
+        self._channel_id = next(
+            (
+                sys.argv[i + 1]
+                for i, arg in enumerate(sys.argv)
+                if arg == "--channel" and i + 1 < len(sys.argv)
+            ),
+            None,
+        )
+
+        # Coding requests are run one at a time by a worker task, started on first use so it
+        # belongs to the event loop the agent runs on.
+        self._coding_queue = None
+        self._coding_worker_task = None
+
         # Initialize an empty message history.
         self.history = []
-        # Initialize the timestamp for the history (unix timestamp).
+        # Initialize the timestamp for the history (time.monotonic() value).
         self.history_timestamp = None
+        # Keep a single long-lived writer connection so SQLite's page and statement caches
+        # survive between queries. Tools run in worker threads, so guard it with a lock.
+        self._conn = self._connect()
+        self._db_lock = threading.RLock()
+        # Counts writes made through query_db; together with PRAGMA data_version (which tracks
+        # commits from other connections) it tells when the tasks table may have changed.
+        self._tasks_version = 0
+        # Rendered pending-tasks prompt as (tasks state, prompt), reused until the state changes.
+        self._pending_tasks_cache = None
+        # Results of the agent's SELECTs during the current turn, as (query, params) ->
+        # (tasks state, result), so a repeated identical query isn't run again.
+        self._select_cache = {}
+        # Thread currently inside transaction(), whose reads must see its uncommitted writes.
+        self._tx_thread = None
+        # Under WAL, SELECTs run concurrently on a pool of read-only connections. An
+        # in-memory database is private to its connection, so it only uses the writer.
+        self._readers = None
+        # Commits are detected with PRAGMA data_version on a connection of its own, so checking
+        # for changes doesn't wait behind the writer lock.
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        if self.DB_FILENAME != ":memory:":
+            self._readers = queue.Queue()
+            for _ in range(READ_POOL_SIZE):
+                reader = self._connect()
+                reader.execute("PRAGMA query_only=1")
+                self._readers.put(reader)
+            self._version_conn = self._connect()
+        atexit.register(self.close)
         # Initialize (or create) the SQLite database for tasks.
         self.init_db()
 
+    @functools.cached_property
+    def agent(self) -> Agent:
+        """
+        Build the agent on first use, together with its model fallback chain, the MCP server
+        and all tools. Deferring this keeps constructing a bot cheap when the agent is never run.
+
+        Returns:
+            Agent: The configured pydantic-ai agent.
+        """
         # Run Python code sandboxed using Pyodide as a MCP server
         run_python_server = MCPServerStdio(
             os.getenv("DENO_PATH"),
@@ -83,203 +527,415 @@ class MorpheusBot:
             ],
         )
         
-        # Initialize the coding agent for coding-related tasks
-        self.coding_agent = CodingAgent()
-
-        # Use Claude if Anthropic API key is set
-        claude37sonnet = AnthropicModel("claude-3-7-sonnet-latest")
-        claude35sonnet = AnthropicModel("claude-3-5-sonnet-latest")
-        claude35haiku  = AnthropicModel("claude-3-5-haiku-latest")
-        o3mini = OpenAIModel("o3-mini")
-        gpt4o  = OpenAIModel("gpt-4o")
-        gpt41  = OpenAIModel("gpt-4.1")
-        gemini25flash = GeminiModel("gemini-2.5-flash", provider="google-gla")
-        gemini20flash = GeminiModel("gemini-2.0-flash", provider="google-gla")
+        # Only build the models in the fallback chain; each one sets up its own provider client
+        claude35sonnet = CachingAnthropicModel("claude-3-5-sonnet-latest")
+        claude35haiku  = CachingAnthropicModel("claude-3-5-haiku-latest")
 
         preferred_model = FallbackModel(
-            claude35sonnet,
-            claude35haiku,
+            CircuitBreakerModel(claude35sonnet),
+            CircuitBreakerModel(claude35haiku),
+            fallback_on=_should_fall_back,
         )
 
         # Initialize the agent with the given system prompt.
-        self.agent = Agent(
+        agent = Agent(
             model=preferred_model,
-            system_prompt=system_prompt,
+            system_prompt=self.system_prompt,
             mcp_servers=[run_python_server],
+            # A stuck request times out and falls back instead of holding up the reply
+            model_settings={"timeout": MODEL_REQUEST_TIMEOUT},
         )
 
-        # Add dynamic system prompt snippets as well.
-        @self.agent.system_prompt
-        def add_the_date() -> str:
-            return f'The current date is {date.today()} and it is a {date.today().strftime("%A")}. The current time is {datetime.now().strftime("%H:%M")} (24-hour clock).'
-
-        @self.agent.system_prompt
-        def read_notes() -> str:
-            """
-            Read in the contents of the notebook file.
-            """
-            filepath = f"{self.notes_dir}/{self.notebook_filename}"
-            if not os.path.exists(filepath):
-                return ""
-            with open(filepath, "r") as f:
-                return (
-                    "Notes you've made so far, including your thoughts and observations:\n"
-                    + f.read()
-                )
+        # Add dynamic system prompt snippets as well, ordered from least to most likely to change
+        # between conversations so they share as long a cacheable prompt prefix as possible.
+        agent.system_prompt(self._notes_prompt)
+        agent.system_prompt(self._pending_tasks_prompt)
+        agent.system_prompt(self._date_prompt)
 
-        @self.agent.system_prompt
-        def fetch_pending_tasks() -> str:
-            """
-            Start every interaction with a full list of all pending tasks, to prime the answers.
-            """
-            tasks = query_task_database(
-                "SELECT id, description, time_added, due, tags, recurrence FROM tasks WHERE time_complete IS NULL ORDER BY time_added DESC"
-            )
-            if not tasks:
-                return ""
-            return (
-                "Here is a list of all pending tasks ordered by most recently added first:\n"
-                + "Columns are id, description, time_added, due, tags, recurrence\n"
-                + tasks
+        # Register the agent tools. They are bound methods, so their schemas leave out self.
+        agent.tool_plain(self.query_task_database)
+        agent.tool_plain(self.write_notes_to_notebook)
+        agent.tool_plain(self.call_coding_agent)
+
+        return agent
+
+    @functools.cached_property
+    def coding_agent(self) -> CodingAgent:
+        """
+        Initialize the coding agent for coding-related tasks on first use.
+
+        Returns:
+            CodingAgent: The coding agent.
+        """
+        return CodingAgent()
+
+    def _date_prompt(self) -> str:
+        """
+        System prompt snippet with the current date, weekday and time.
+        """
+        return f'The current date is {date.today()} and it is a {date.today().strftime("%A")}. The current time is {datetime.now().strftime("%H:%M")} (24-hour clock).'
+
+    def _notes_prompt(self) -> str:
+        """
+        Read in the contents of the notebook file. The prompt is cached and only re-read when
+        the file's modification time or size changes, e.g. after notes were added or the
+        notebook was edited by hand.
+        """
+        filepath = f"{self.notes_dir}/{self.notebook_filename}"
+        try:
+            st = os.stat(filepath)
+        except FileNotFoundError:
+            return ""
+        key = (st.st_mtime_ns, st.st_size)
+        if self._notes_cache and self._notes_cache[0] == key:
+            return self._notes_cache[1]
+
+        with open(filepath, "r", encoding="utf-8") as f:
+            prompt = (
+                "Notes you've made so far, including your thoughts and observations:\n"
+                + f.read()
             )
+        self._notes_cache = (key, prompt)
+        return prompt
 
-        # Register agent tools as inner asynchronous functions decorated with tool_plain.
-        @self.agent.tool_plain()
-        def query_task_database(query: str, params: tuple = ()) -> str:
-            """
-            Query the task database with a given SQL query. You can read data with
-            SELECT queries and update data with INSERT and UPDATE queries.
-            The database is an SQLite database with a single table named 'tasks'.
-
-            Schema for the 'tasks' table:
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                description TEXT NOT NULL,
-                time_added TEXT NOT NULL,
-                time_complete TEXT,
-                due TEXT DEFAULT '',
-                tags TEXT DEFAULT '',
-                recurrence TEXT DEFAULT '',
-                points INT DEFAULT 1
-
-            Important details on how to use this dataset and the fields:
-            The 'time_added' and 'time_complete' fields are stored as ISO 8601 strings.
-            The 'time_complete' field is empty for tasks that are not yet complete.
-            When marking a task as complete, always check the 'recurrence' field to see if the task should be rescheduled.
-            If a task should be rescheduled, add a new task with the same description and tags, but with a new 'due' date.
-            The 'due' field can be a date, time, or a generic description of a future period.
-            The 'recurrence' field is a string that describes how often the task should recur.
-            The 'recurrence' field is empty for tasks that do not recur, and that applies to the majority of tasks.
-            The 'tags' field is a comma-separated list of lowercased tags. Tags are used to group tasks.
-            When multiple tags are used, split them by comma to understand the task better.
-            The 'tags' field is empty for tasks that have no tags yet. Suggest tags that might be useful.
-            The 'points' field is used as rewards for completing tasks. Small tasks award 1 point and bigger tasks more points.
-            Help the user to complete tasks to increase their total XP.
-
-            Args:
-                query (str): The SQL query to execute.
-                params (tuple): The parameters to pass to the query, if any.
-            Returns:
-                str: The result of the query as a formatted string.
-            """
+    def query_task_database(self, query: str, params: tuple = ()) -> str:
+        """
+        Query the task database with a given SQL query. You can read data with
+        SELECT queries and update data with INSERT and UPDATE queries.
+        The database is an SQLite database with a single table named 'tasks'.
+
+        Schema for the 'tasks' table:
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            description TEXT NOT NULL,
+            time_added TEXT NOT NULL,
+            time_complete TEXT,
+            due TEXT DEFAULT '',
+            tags TEXT DEFAULT '',
+            recurrence TEXT DEFAULT '',
+            points INT DEFAULT 1
+
+        Important details on how to use this dataset and the fields:
+        The 'time_added' and 'time_complete' fields are stored as ISO 8601 strings.
+        The 'time_complete' field is empty for tasks that are not yet complete.
+        When marking a task as complete, always check the 'recurrence' field to see if the task should be rescheduled.
+        If a task should be rescheduled, add a new task with the same description and tags, but with a new 'due' date.
+        The 'due' field can be a date, time, or a generic description of a future period.
+        The 'recurrence' field is a string that describes how often the task should recur.
+        The 'recurrence' field is empty for tasks that do not recur, and that applies to the majority of tasks.
+        The 'tags' field is a comma-separated list of lowercased tags. Tags are used to group tasks.
+        When multiple tags are used, split them by comma to understand the task better.
+        The 'tags' field is empty for tasks that have no tags yet. Suggest tags that might be useful.
+        The 'points' field is used as rewards for completing tasks. Small tasks award 1 point and bigger tasks more points.
+        Help the user to complete tasks to increase their total XP.
+
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to pass to the query, if any.
+        Returns:
+            str: The result rows as tab-separated values, one row per line.
+        """
+        key = None
+        if query.lstrip()[:6].upper() == "SELECT":
+            key = (query, tuple(params))
+            state = self._tasks_state()
             try:
-                rows = self.query_db(query, params)
-                return "\n".join([str(row) for row in rows])
-            except sqlite3.Error as e:
-                return f"Error executing query: {e}"
-
-        @self.agent.tool_plain()
-        def write_notes_to_notebook(text: str) -> str:
-            """
-            Note down a generic observation about something you learned about the user. Only write thoughts and observations. It is not necessary to mention that the user completed a task. Task details do not belong here, only note down observations that appear to be true both today and in general. Write concisely.
-
-            Args:
-                text (str): The text to write to the notebook.
-            Returns:
-                str: A confirmation message.
-            """
-            filepath = f"{self.notes_dir}/{self.notebook_filename}"
+                cached = self._select_cache.get(key)
+            except TypeError:
+                # Unhashable parameters, such as nested lists, are just not cached
+                key = cached = None
+            if cached and cached[0] == state:
+                return cached[1]
+
+        try:
+            rows = self.query_db(query, params)
+        except sqlite3.Error as e:
+            return f"Error executing query: {e}"
+        result = _format_rows(rows)
+        if key:
+            self._select_cache[key] = (state, result)
+        return result
+
+    def write_notes_to_notebook(self, text: str) -> str:
+        """
+        Note down a generic observation about something you learned about the user. Only write thoughts and observations. It is not necessary to mention that the user completed a task. Task details do not belong here, only note down observations that appear to be true both today and in general. Write concisely.
+
+        Args:
+            text (str): The text to write to the notebook.
+        Returns:
+            str: A confirmation message.
+        """
+        self._pending_notes.append(text)
+        if len(self._pending_notes) >= NOTES_BATCH_SIZE:
             try:
-                with open(filepath, "a") as f:
-                    f.write(text + "\n")
-                return "Text written to notebook."
+                self.flush_notes()
             except Exception as e:
                 return f"Error writing to notebook: {e}"
-            
-        @self.agent.tool_plain()
-        async def call_coding_agent(query: str) -> str:
-            """
-            Delegate coding-related tasks to the specialized coding agent powered by Claude.
-            This agent has specialized capabilities for software development tasks.
-            Use this tool when the user needs help with coding, development, or technical software questions.
-            
-            The coding agent will work on the task and provide updates on its progress.
-            
-            Args:
-                query (str): The coding-related query or task to delegate to the coding agent.
-            Returns:
-                str: Confirmation that the coding agent has started working on the task.
-            """
-            self.audit_logger.info(f"Delegating coding task to coding agent: {query}")
-            
-            # Start a background task to process the coding query and stream updates
-            asyncio.create_task(self._process_coding_query(query))
-            
-            return "Coding agent is now working on your request. You will receive updates as progress is made."
+        return "Text written to notebook."
+
+    async def call_coding_agent(self, query: str) -> str:
+        """
+        Delegate coding-related tasks to the specialized coding agent powered by Claude.
+        This agent has specialized capabilities for software development tasks.
+        Use this tool when the user needs help with coding, development, or technical software questions.
+
+        The coding agent will work on the task and provide updates on its progress.
+
+        Args:
+            query (str): The coding-related query or task to delegate to the coding agent.
+        Returns:
+            str: Confirmation that the coding agent has started working on the task.
+        """
+        self.audit_logger.info(f"Delegating coding task to coding agent: {query}")
+
+        # Hand the query to the coding worker, which processes it and streams updates
+        if self._coding_worker_task is None or self._coding_worker_task.done():
+            self._coding_queue = asyncio.Queue(maxsize=CODING_QUEUE_SIZE)
+            self._coding_worker_task = asyncio.create_task(self._coding_worker())
+        try:
+            self._coding_queue.put_nowait(query)
+        except asyncio.QueueFull:
+            self.audit_logger.warning("Coding agent queue is full, turning the request away")
+            return "The coding agent is busy with other requests. Ask the user to try again when those have finished."
+
+        return "Coding agent is now working on your request. You will receive updates as progress is made."
+
+    async def _coding_worker(self) -> None:
+        """
+        Process queued coding queries one at a time, so their Slack updates don't interleave.
+        Queries taking longer than CODING_QUERY_TIMEOUT are cancelled.
+        """
+        while True:
+            query = await self._coding_queue.get()
+            try:
+                await asyncio.wait_for(self._process_coding_query(query), CODING_QUERY_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.audit_logger.error(f"Coding agent timed out after {CODING_QUERY_TIMEOUT}s: {query}")
+                await self._send_slack_update({
+                    "blocks": [{
+                        "type": "rich_text",
+                        "elements": [{
+                            "type": "rich_text_section",
+                            "elements": [
+                                {"type": "emoji", "name": "warning"},
+                                {"type": "text", "text": " The coding agent took too long and was stopped."}
+                            ]
+                        }]
+                    }],
+                    "text": "Coding agent timeout"
+                })
+            finally:
+                self._coding_queue.task_done()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a connection to the task database with WAL journaling and tuned PRAGMAs.
+
+        Returns:
+            sqlite3.Connection: The configured database connection.
+        """
+        conn = sqlite3.connect(
+            self.DB_FILENAME,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        cursor = conn.cursor()
+        # WAL lets readers run alongside a writer and avoids an fsync per commit.
+        # In-memory databases do not support it, so leave their journal alone.
+        if self.DB_FILENAME != ":memory:":
+            cursor.execute("PRAGMA journal_mode=WAL")
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        return conn
+
+    def close(self) -> None:
+        """
+        Stop the message log thread and close the writer and all reader connections to the
+        database, waiting for readers still in use. Safe to call more than once; an explicit
+        close also drops the atexit hook, so the bot can be garbage collected.
+        """
+        atexit.unregister(self.close)
+        self._close_message_log()
+        readers, self._readers = self._readers, None
+        if readers is not None:
+            for _ in range(READ_POOL_SIZE):
+                readers.get().close()
+        if self._version_conn is not None:
+            with self._version_lock:
+                self._version_conn.close()
+        with self._db_lock:
+            self._conn.close()
 
     def init_db(self):
         """
         Initialize the SQLite database and create the tasks table if it doesn't exist.
-        Also, check if the 'due', 'tags', and 'recurrence' columns exist and ALTER TABLE to add them if missing.
+        Databases created before the 'due', 'tags', 'recurrence' and 'points' columns existed
+        are migrated with ALTER TABLE, and the task indexes are created. All DDL runs in a
+        single transaction, and PRAGMA user_version lets later startups skip it entirely.
         """
-        conn = sqlite3.connect(self.DB_FILENAME)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                description TEXT NOT NULL,
-                time_added TEXT NOT NULL,
-                time_complete TEXT,
-                due TEXT DEFAULT '',
-                tags TEXT DEFAULT '',
-                recurrence TEXT DEFAULT '',
-                points INT DEFAULT 1
-            )
-            """
-        )
-        conn.commit()
-        cursor.execute("PRAGMA table_info(tasks)")
-        columns = [row[1] for row in cursor.fetchall()]
+        cursor = self._conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
 
-        if "due" not in columns:
-            cursor.execute("ALTER TABLE tasks ADD COLUMN due TEXT DEFAULT ''")
-            conn.commit()
+        # Run all DDL in one transaction so startup pays for a single commit
+        with self.transaction():
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    description TEXT NOT NULL,
+                    time_added TEXT NOT NULL,
+                    time_complete TEXT,
+                    due TEXT DEFAULT '',
+                    tags TEXT DEFAULT '',
+                    recurrence TEXT DEFAULT '',
+                    points INT DEFAULT 1
+                )
+                """
+            )
+            cursor.execute("PRAGMA table_info(tasks)")
+            columns = [row[1] for row in cursor.fetchall()]
+            for column, definition in TASK_COLUMN_MIGRATIONS:
+                if column not in columns:
+                    cursor.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+            for index in TASK_INDEXES:
+                cursor.execute(index)
+            cursor.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
 
-        if "tags" not in columns:
-            cursor.execute("ALTER TABLE tasks ADD COLUMN tags TEXT DEFAULT ''")
-            conn.commit()
+    def _write_notes_batch(self, notes: List[str]) -> None:
+        """
+        Append several notes to the notebook file with a single write, on a raw file descriptor
+        since the text is written in one go and needs no buffering.
 
-        if "recurrence" not in columns:
-            cursor.execute("ALTER TABLE tasks ADD COLUMN recurrence TEXT DEFAULT ''")
-            conn.commit()
+        Args:
+            notes: The notes to append, one line each.
+        """
+        filepath = f"{self.notes_dir}/{self.notebook_filename}"
+        data = "".join(f"{text}\n" for text in notes).encode("utf-8")
+        fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # os.write may write less than asked, e.g. on a full disk or after a signal
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        # Don't rely on the mtime alone, its resolution can be coarser than two quick writes
+        self._notes_cache = None
 
-        if "points" not in columns:
-            cursor.execute("ALTER TABLE tasks ADD COLUMN points INT DEFAULT 1")
-            conn.commit()
+    def flush_notes(self) -> None:
+        """
+        Write all notes buffered since the last flush to the notebook. If the write fails, the
+        notes are put back in the buffer so the next flush retries them.
+        """
+        notes, self._pending_notes = self._pending_notes, []
+        if not notes:
+            return
+        try:
+            self._write_notes_batch(notes)
+        except Exception:
+            self._pending_notes[:0] = notes
+            raise
 
-        conn.close()
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run several statements on the shared connection as one write transaction with a single
+        commit. The connection lock is held throughout, so statements from other threads cannot
+        interleave; query_db may still be called from within the block on the same thread.
+        """
+        with self._db_lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._tx_thread = threading.get_ident()
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+            else:
+                self._conn.commit()
+                # Statements run directly on the yielded connection bypass query_db's counter
+                self._tasks_version += 1
+            finally:
+                self._tx_thread = None
 
     def query_db(self, query, params=()):
         """
         Execute a query on the SQLite database and return the results.
+        SELECTs are served by the read-only connection pool; all other statements go through
+        the single writer connection, which runs in autocommit mode.
         """
         self.log_query(query, params)
-        with sqlite3.connect(self.DB_FILENAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            conn.commit()
-        return results
+        readers = self._readers
+        if (
+            readers is not None
+            and self._tx_thread != threading.get_ident()
+            and query.lstrip()[:6].upper() == "SELECT"
+        ):
+            reader = readers.get()
+            try:
+                return reader.execute(query, params).fetchall()
+            finally:
+                readers.put(reader)
+
+        with self._db_lock:
+            cursor = self._conn.execute(query, params)
+            self._tasks_version += 1
+            return cursor.fetchall()
+
+    def _tasks_state(self) -> tuple[int, int]:
+        """
+        Return a value that changes whenever the task database may have been modified, either
+        through this bot or by another connection such as a second Morpheus process.
+        """
+        version = self._tasks_version
+        if self._version_conn is None:
+            with self._db_lock:
+                return (version, self._conn.execute("PRAGMA data_version").fetchone()[0])
+        with self._version_lock:
+            return (version, self._version_conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def _pending_tasks_prompt(self) -> str:
+        """
+        Build the system prompt snippet listing the pending tasks, at most PENDING_TASKS_LIMIT
+        of the most recently added. The rendered text is cached and only rebuilt after the task
+        database has changed.
+
+        Returns:
+            str: The pending tasks prompt, or an empty string if there are none.
+        """
+        state = self._tasks_state()
+        if self._pending_tasks_cache and self._pending_tasks_cache[0] == state:
+            return self._pending_tasks_cache[1]
+
+        try:
+            rows = self.query_db(PENDING_TASKS_QUERY)
+        except sqlite3.Error as e:
+            self.audit_logger.error(f"Error fetching pending tasks: {e}")
+            return ""
+        prompt = ""
+        if len(rows) > PENDING_TASKS_LIMIT:
+            prompt = (
+                f"Here are the {PENDING_TASKS_LIMIT} most recently added pending tasks, newest first. "
+                + "There are more; query the task database to see older pending tasks.\n"
+                + "Columns are id, description, time_added, due, tags, recurrence\n"
+                + _format_rows(rows[:PENDING_TASKS_LIMIT])
+            )
+        elif rows:
+            prompt = (
+                "Here is a list of all pending tasks ordered by most recently added first:\n"
+                + "Columns are id, description, time_added, due, tags, recurrence\n"
+                + _format_rows(rows)
+            )
+        self._pending_tasks_cache = (state, prompt)
+        return prompt
+
+    def reset_turn_cache(self) -> None:
+        """
+        Forget the SELECT results cached during the previous turn. Call this before each agent
+        run; queries can depend on the current time, so results are only reused within a turn.
+        """
+        self._select_cache.clear()
 
     def log_query(self, query, params):
         """
@@ -289,26 +945,88 @@ class MorpheusBot:
 
     def log_messages(self, result, history):
         """
-        Log each message to disk in JSON format.
+        Log each message to disk in JSON format. The write happens on the message log thread;
+        use flush_message_log() to wait for it.
         """
-        # Use the entire list if this is the first interaction in the thread
-        messages = result.new_messages_json() if history else result.all_messages_json()
-        messages_json = to_jsonable_python(messages)
+        # Use the entire list if this is the first interaction in the thread.
+        # pydantic-ai already serializes the messages to JSON bytes, so write them as-is.
+        messages_json = result.new_messages_json() if history else result.all_messages_json()
+        self._msg_log_queue.put(messages_json)
+
+    def flush_message_log(self) -> None:
+        """
+        Block until every queued message log entry has been written.
+        """
+        self._msg_log_queue.join()
+
+    def _message_log_worker(self) -> None:
+        """
+        Append queued message log entries to disk, one JSON array per line. Entries that queued
+        up while the previous write was running are written together, with a single flush. A None
+        entry stops the thread.
+        """
+        while True:
+            batch = [self._msg_log_queue.get()]
+            while True:
+                try:
+                    batch.append(self._msg_log_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                entries = [entry for entry in batch if entry is not None]
+                if entries:
+                    f = self._message_log_file()
+                    f.write(b"\n".join(entries) + b"\n")
+                    f.flush()
+            except Exception as e:
+                self.audit_logger.error(f"Error writing message log: {e}")
+            finally:
+                for _ in batch:
+                    self._msg_log_queue.task_done()
 
-        # Use a date-stamped filename for the message history
-        filepath = f"{self.log_dir}/messages.{datetime.now().strftime('%Y-%m-%d')}.json"
-        with open(filepath, "a") as f:
-            f.write(messages_json)
+            if None in batch:
+                if self._msg_log_fh:
+                    self._msg_log_fh.close()
+                    self._msg_log_fh = None
+                return
+
+    def _message_log_file(self) -> BinaryIO:
+        """
+        Return the open message log for today. The file is only reopened when the date changes,
+        using a date-stamped filename for the message history.
+
+        Returns:
+            BinaryIO: The message log file handle.
+        """
+        today = date.today()
+        if today != self._msg_log_date:
+            if self._msg_log_fh:
+                self._msg_log_fh.close()
+            filepath = f"{self.log_dir}/messages.{today.isoformat()}.json"
+            self._msg_log_fh = open(filepath, "ab", buffering=1 << 16)
+            self._msg_log_date = today
+        return self._msg_log_fh
+
+    def _close_message_log(self) -> None:
+        """
+        Write any queued message log entries, then stop the message log thread and close the file.
+        """
+        if self._msg_log_writer.is_alive():
+            self._msg_log_queue.put(None)
+            self._msg_log_writer.join()
 
     def set_history(self, history):
         """
-        Update the bot's history with the given history and record the current unix timestamp.
+        Update the bot's history with the given history and record the current monotonic time.
+        Long conversations are trimmed to the most recent turns, so each turn doesn't resend an
+        ever-growing history to the model.
 
         Arguments:
             history: A list of messages to update the bot's history with.
         """
-        self.history = history
-        self.history_timestamp = time.time()
+        self.history = _trim_history(history)
+        self.history_timestamp = time.monotonic()
 
     def get_history(self):
         """
@@ -318,11 +1036,10 @@ class MorpheusBot:
         Returns:
             list: The current valid history.
         """
-        one_hour = 1 * 3600
-        current_time = time.time()
-        if self.history_timestamp and (
-            current_time - self.history_timestamp > one_hour
-        ):
+        if not self.history:
+            return self.history
+        # Monotonic time, so a wall clock adjustment can't expire or extend the history
+        if time.monotonic() - self.history_timestamp > HISTORY_TTL:
             self.history = []
             self.history_timestamp = None
         return self.history
@@ -334,12 +1051,18 @@ class MorpheusBot:
         Args:
             query: The coding query to process
         """
+        self.audit_logger.info("Starting coding agent processing with streaming updates...")
+        
+        # Create a temporary storage for Slack blocks to be sent as updates
+        blocks = []
+        pending_chars = 0
+        loop = asyncio.get_running_loop()
+        last_flush = loop.time()
+        # The previous post runs in the background while the stream is read; it is awaited
+        # before the next one starts so updates arrive in order.
+        send_task = None
+        error = None
         try:
-            self.audit_logger.info("Starting coding agent processing with streaming updates...")
-            
-            # Create a temporary storage for Slack blocks to be sent as updates
-            blocks = []
-            
             # Get the streaming response from the coding agent
             stream_result = await self.coding_agent.process_query(query)
             
@@ -360,9 +1083,17 @@ class MorpheusBot:
                             }]
                         }
                         blocks.append(block)
+                        pending_chars += len(update)
                         
-                        # Every few updates or when the message is important, send to Slack
-                        if len(blocks) >= 3 or "completed" in update.lower() or "finished" in update.lower():
+                        # Send to Slack once the batch is old or large enough, or when the message is important
+                        update_lower = update.lower()
+                        if (
+                            loop.time() - last_flush >= CODING_UPDATE_FLUSH_INTERVAL
+                            or pending_chars >= CODING_UPDATE_MAX_CHARS
+                            or len(blocks) >= SLACK_MAX_BLOCKS
+                            or "completed" in update_lower
+                            or "finished" in update_lower
+                        ):
                             # Send the update to Slack
                             slack_message = {"blocks": blocks, "text": "Coding agent update"}
                             
@@ -370,19 +1101,29 @@ class MorpheusBot:
                             self.audit_logger.info(f"Sending coding agent update to Slack")
                             
                             # Process this via our regular Slack update mechanism
-                            await self._send_slack_update(slack_message)
+                            if send_task:
+                                await send_task
+                            send_task = asyncio.create_task(self._send_slack_update(slack_message))
                             
                             # Clear blocks for the next batch
                             blocks = []
-            
-            # Send any remaining blocks as a final update
-            if blocks:
-                slack_message = {"blocks": blocks, "text": "Coding agent final update"}
-                self.audit_logger.info("Sending final coding agent update")
-                await self._send_slack_update(slack_message)
-                
+                            pending_chars = 0
+                            last_flush = loop.time()
         except Exception as e:
             self.audit_logger.error(f"Error in coding agent processing: {e}")
+            error = e
+
+        # Updates received before a failure still go out, ahead of the error message
+        if send_task:
+            await send_task
+
+        # Send any remaining blocks as a final update
+        if blocks:
+            slack_message = {"blocks": blocks, "text": "Coding agent final update"}
+            self.audit_logger.info("Sending final coding agent update")
+            await self._send_slack_update(slack_message)
+
+        if error:
             error_message = {
                 "blocks": [{
                     "type": "rich_text",
@@ -390,7 +1131,7 @@ class MorpheusBot:
                         "type": "rich_text_section", 
                         "elements": [
                             {"type": "emoji", "name": "warning"},
-                            {"type": "text", "text": f" Error in coding agent: {str(e)}"}
+                            {"type": "text", "text": f" Error in coding agent: {str(error)}"}
                         ]
                     }]
                 }],
@@ -406,19 +1147,10 @@ class MorpheusBot:
             slack_message: The formatted Slack message to send
         """
         try:
+            # Imported here since morpheus.py imports this module (and is only loaded by the Slack bot)
             from morpheus import app
-            
-            # Get the channel ID from command-line arguments in morpheus.py
-            import sys
-            import re
-            
-            # Try to find the channel ID from command-line arguments
-            channel_id = None
-            for i, arg in enumerate(sys.argv):
-                if arg == "--channel" and i + 1 < len(sys.argv):
-                    channel_id = sys.argv[i + 1]
-                    break
-            
+
+            channel_id = self._channel_id
             if channel_id:
                 # Post message to the channel
                 await app.client.chat_postMessage(
@@ -443,52 +1175,22 @@ class MorpheusBot:
             dict: A dictionary following the Slack Bolt block format.
         """
         self.audit_logger.info(f"Processing message: {text.strip()}")
-        async with self.agent.run_mcp_servers():
-            result = await self.agent.run(text, message_history=self.get_history())
+        self.reset_turn_cache()
+        try:
+            async with self.agent.run_mcp_servers():
+                result = await self.agent.run(text, message_history=self.get_history())
+        finally:
+            # Persist the notes written during this turn in a single append
+            try:
+                await asyncio.to_thread(self.flush_notes)
+            except Exception as e:
+                self.audit_logger.error(f"Error writing to notebook: {e}")
+        # Queued for the message log thread, so the reply isn't held up by the write
         self.log_messages(result, self.history)
         self.audit_logger.info(f"Token usage: {result.usage()}")
         self.set_history(result.all_messages())
 
-        slack_message = {"blocks": [], "text": result.data}
-        for msg in result.new_messages():
-            block = {
-                "type": "rich_text",
-                "elements": [{"type": "rich_text_section", "elements": []}],
-            }
-            elements = block["elements"][0]["elements"]
-
-            for part in msg.parts:
-                if isinstance(part, TextPart) and part.has_content():
-                    elements.append({"type": "text", "text": part.content + "\n"})
-                elif isinstance(part, ToolCallPart):
-                    # Choose emoji based on tool name
-                    emoji_name = "gear"
-
-                    if part.tool_name == "query_task_database" and part.has_content():
-                        # For SQL queries, customize emoji based on query type
-                        query_text = str(part.args).upper().strip() if part.args else ""
-                        if query_text.startswith("SELECT"):
-                            emoji_name = "mag"  # Magnifying glass for SELECT
-                        elif query_text.startswith("INSERT"):
-                            emoji_name = "heavy_plus_sign"  # Plus for INSERT
-                        elif query_text.startswith("UPDATE"):
-                            emoji_name = "pencil"  # Pencil for UPDATE
-                        elif query_text.startswith("DELETE"):
-                            emoji_name = "wastebasket"  # Trash for DELETE
-                        else:
-                            emoji_name = (
-                                "card_index_dividers"  # Default for other DB operations
-                            )
-                    elif part.tool_name == "write_notes_to_notebook":
-                        emoji_name = "memo"  # Memo for notebook operations
-                    elif part.tool_name == "call_coding_agent":
-                        emoji_name = "robot_face"  # Robot for coding agent
-
-                    elements.append({"type": "emoji", "name": emoji_name})
-                    elements.append(
-                        {"type": "text", "text": f" Called {part.tool_name}\n"}
-                    )
-
-            slack_message["blocks"].append(block)
-
-        return slack_message
\ No newline at end of file
+        return {
+            "blocks": [_message_block(msg) for msg in result.new_messages()],
+            "text": result.data,
+        }
\ No newline at end of file
@@ -83,12 +83,19 @@ async def on_message(message: cl.Message):
         
         async with bot.agent.run_mcp_servers():
             with cl.Step(name="Processing request") as step:
+                bot.reset_turn_cache()
                 result = await bot.agent.run(message.content, message_history=bot.get_history())
                 
                 bot.log_messages(result, bot.history)
                 bot.set_history(result.all_messages())
+                # Persist the notes written during this turn; a failure keeps them buffered
+                # for the next turn instead of discarding the reply
+                try:
+                    await asyncio.to_thread(bot.flush_notes)
+                except Exception as e:
+                    logger.error(f"Error writing to notebook: {e}")
                 
-                intermediate_content = ""
+                intermediate_parts = []
                 final_content = ""
                 tool_calls = []
                 
@@ -96,7 +103,7 @@ async def on_message(message: cl.Message):
                 
                 for i, msg in enumerate(messages):
                     is_final_message = (i == len(messages) - 1)
-                    message_content = ""
+                    message_parts = []
                     
                     for part in msg.parts:
                         if hasattr(part, 'has_content') and part.has_content():
@@ -108,18 +115,18 @@ async def on_message(message: cl.Message):
                                 }
                                 tool_calls.append(tool_call_content)
                                 
-                                message_content += f"\n\nTool Call: {part.tool_name}\n"
+                                message_parts.append(f"\n\nTool Call: {part.tool_name}\n")
                                 if hasattr(part, 'content') and part.content:
-                                    message_content += f"Result: {part.content}\n"
+                                    message_parts.append(f"Result: {part.content}\n")
                             else:  # For TextPart
-                                message_content += part.content
+                                message_parts.append(part.content)
                     
                     if is_final_message:
-                        final_content = message_content
+                        final_content = "".join(message_parts)
                     else:
-                        intermediate_content += message_content
+                        intermediate_parts.extend(message_parts)
                 
-                step.output = intermediate_content
+                step.output = "".join(intermediate_parts)
         
         await cl.Message(content=final_content).send()
         
@@ -17,6 +17,24 @@ def temp_db_path(tmp_path):
     return str(db_path)
 
 
+@pytest.fixture
+def bot_env(tmp_path, monkeypatch):
+    """Set the environment variables MorpheusBot requires and work in a temporary directory."""
+    monkeypatch.setenv("OPENAI_API_KEY", "mock_value")
+    monkeypatch.setenv("DENO_PATH", "mock_value")
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def bot(bot_env, temp_db_path):
+    """Create a MorpheusBot on a temporary database, and close it after the test."""
+    from agent import MorpheusBot
+
+    bot = MorpheusBot(db_filename=temp_db_path)
+    yield bot
+    bot.close()
+
+
 @pytest.fixture
 def mock_run_result():
     """Create a mock result from agent.run()."""
@@ -171,6 +189,26 @@ class TestMorpheusBot:
             assert results[0][1] == "Test task"  # description
             assert results[0][2] == "2023-01-01T00:00:00"  # time_added
 
+    def test_database_uses_wal(self, bot):
+        """Test that the task database is switched to WAL journaling."""
+        # The journal mode is persisted in the database file itself
+        results = bot.query_db("PRAGMA journal_mode")
+        assert results[0][0] == "wal"
+
+    def test_in_memory_database_persists(self, bot_env):
+        """Test that an in-memory database keeps its schema and data between queries."""
+        from agent import MorpheusBot
+
+        bot = MorpheusBot(db_filename=":memory:")
+
+        # The tasks table created by init_db must be visible to query_db
+        bot.query_db(
+            "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+            ("Test task", "2023-01-01T00:00:00")
+        )
+        results = bot.query_db("SELECT description FROM tasks")
+        assert results == [("Test task",)]
+
     def test_history_management(self):
         """Test history management functions."""
         from agent import MorpheusBot
@@ -203,7 +241,272 @@ class TestMorpheusBot:
             assert retrieved_history == test_history
             
             # Test history expiration (mock time to be more than 1 hour later)
-            with patch('time.time') as mock_time:
+            with patch('time.monotonic') as mock_time:
                 mock_time.return_value = bot.history_timestamp + 3601  # 1 hour + 1 second
                 expired_history = bot.get_history()
                 assert expired_history == []  # History should be cleared
+
+    def test_init_db_migrates_old_schema(self, bot_env, temp_db_path):
+        """Test that a tasks table from before the extra columns is migrated once."""
+        from agent import MorpheusBot, PENDING_TASKS_QUERY, SCHEMA_VERSION
+
+        # Create a database with the original tasks schema
+        conn = sqlite3.connect(temp_db_path)
+        conn.execute(
+            "CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "description TEXT NOT NULL, time_added TEXT NOT NULL, time_complete TEXT)"
+        )
+        conn.commit()
+        conn.close()
+
+        bot = MorpheusBot(db_filename=temp_db_path)
+
+        columns = [row[1] for row in bot.query_db("PRAGMA table_info(tasks)")]
+        assert {"due", "tags", "recurrence", "points"} <= set(columns)
+        assert bot.query_db("PRAGMA user_version")[0][0] == SCHEMA_VERSION
+
+        indexes = [row[1] for row in bot.query_db("PRAGMA index_list(tasks)")]
+        assert "idx_tasks_pending" in indexes
+        plan = " ".join(str(row) for row in bot.query_db(f"EXPLAIN QUERY PLAN {PENDING_TASKS_QUERY}"))
+        assert "idx_tasks_pending" in plan
+        assert "idx_tasks_due" in indexes
+        plan = " ".join(str(row) for row in bot.query_db(
+            "EXPLAIN QUERY PLAN SELECT id FROM tasks WHERE due < ?", ("2025-01-01",)))
+        assert "idx_tasks_due" in plan
+
+    def test_log_messages(self, bot, tmp_path):
+        """Test that messages from consecutive turns are appended to today's log file."""
+        from datetime import date
+
+        result = MagicMock()
+        result.all_messages_json.return_value = b'[{"turn": 1}]'
+        result.new_messages_json.return_value = b'[{"turn": 2}]'
+
+        # The first turn logs the whole conversation, later turns only new messages
+        bot.log_messages(result, [])
+        bot.log_messages(result, ["previous message"])
+        bot.flush_message_log()
+
+        log_file = tmp_path / "logs" / f"messages.{date.today().isoformat()}.json"
+        assert log_file.read_text() == '[{"turn": 1}]\n[{"turn": 2}]\n'
+
+        # Entries still queued at shutdown are written before the file is closed
+        bot.log_messages(result, ["previous message"])
+        bot._close_message_log()
+        assert log_file.read_text() == '[{"turn": 1}]\n[{"turn": 2}]\n[{"turn": 2}]\n'
+        assert bot._msg_log_fh is None
+
+    def test_close(self, bot):
+        """Test that close stops the message log thread and closes every connection."""
+        readers = list(bot._readers.queue)
+        bot.close()
+
+        assert not bot._msg_log_writer.is_alive()
+        for conn in [bot._conn, *readers]:
+            with pytest.raises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+        # Closing again is harmless
+        bot.close()
+
+    def test_transaction_rolls_back_on_error(self, bot):
+        """Test that statements in a failed transaction are rolled back together."""
+        insert = "INSERT INTO tasks (description, time_added) VALUES (?, ?)"
+
+        with bot.transaction():
+            bot.query_db(insert, ("Committed task", "2023-01-01T00:00:00"))
+
+        with pytest.raises(sqlite3.IntegrityError):
+            with bot.transaction():
+                bot.query_db(insert, ("Rolled back task", "2023-01-01T00:00:00"))
+                bot.query_db(insert, (None, "2023-01-01T00:00:00"))
+
+        results = bot.query_db("SELECT description FROM tasks")
+        assert results == [("Committed task",)]
+
+    def test_read_pool(self, bot):
+        """Test that SELECTs use the read pool except inside the caller's own transaction."""
+        # Reader connections refuse writes
+        reader = bot._readers.get()
+        with pytest.raises(sqlite3.OperationalError):
+            reader.execute("DELETE FROM tasks")
+        bot._readers.put(reader)
+
+        with bot.transaction():
+            bot.query_db(
+                "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+                ("Test task", "2023-01-01T00:00:00")
+            )
+            # Uncommitted writes are visible to the transaction's own thread
+            assert len(bot.query_db("SELECT * FROM tasks")) == 1
+
+        assert len(bot.query_db("SELECT * FROM tasks")) == 1
+
+    def test_pending_tasks_prompt_cache(self, bot, temp_db_path):
+        """Test that the pending tasks prompt is reused until the tasks table changes."""
+        assert bot._pending_tasks_prompt() == ""
+
+        # A write through the bot invalidates the cached prompt
+        bot.query_db(
+            "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+            ("First task", "2023-01-01T00:00:00")
+        )
+        assert "First task" in bot._pending_tasks_prompt()
+
+        # Unchanged database: the prompt is served without querying
+        with patch.object(bot, 'query_db', side_effect=AssertionError("not cached")):
+            assert "First task" in bot._pending_tasks_prompt()
+
+        # A commit from another connection also invalidates it
+        conn = sqlite3.connect(temp_db_path)
+        conn.execute(
+            "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+            ("Second task", "2023-01-02T00:00:00")
+        )
+        conn.commit()
+        conn.close()
+        assert "Second task" in bot._pending_tasks_prompt()
+
+    def test_cached_select_does_not_wait_for_writer(self, bot):
+        """Test that a tool SELECT isn't held up by a write transaction on another thread."""
+        import threading
+
+        results = []
+        query = threading.Thread(target=lambda: results.append(bot.query_task_database("SELECT 1")))
+        with bot.transaction():
+            query.start()
+            query.join(timeout=5)
+            assert results == ["1"]
+
+    def test_pending_tasks_prompt_limit(self, bot):
+        """Test that only the most recent pending tasks are listed when there are many."""
+        from agent import PENDING_TASKS_LIMIT
+
+        assert bot._pending_tasks_prompt() == ""
+        with bot.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+                [(f"Task {i}", f"2023-01-01T00:00:{i:03d}") for i in range(PENDING_TASKS_LIMIT)]
+            )
+
+        # Exactly at the limit, all tasks are listed without pointing at more
+        prompt = bot._pending_tasks_prompt()
+        assert "There are more" not in prompt
+        assert "Task 0\t" in prompt
+        assert len(prompt.splitlines()) == PENDING_TASKS_LIMIT + 2
+
+        with bot.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (description, time_added) VALUES (?, ?)",
+                [(f"Task {i}", f"2023-01-01T00:00:{i:03d}") for i in range(PENDING_TASKS_LIMIT, PENDING_TASKS_LIMIT + 5)]
+            )
+
+        prompt = bot._pending_tasks_prompt()
+        assert "query the task database to see older pending tasks" in prompt
+        assert f"Task {PENDING_TASKS_LIMIT + 4}\t" in prompt
+        assert "Task 4\t" not in prompt
+        assert len(prompt.splitlines()) == PENDING_TASKS_LIMIT + 2
+
+    @pytest.mark.asyncio
+    async def test_coding_updates_are_batched(self, bot):
+        """Test that coding agent updates are posted to Slack in order, in batches."""
+        from agent import CODING_UPDATE_MAX_CHARS
+
+        updates = ["Reading the code", "x" * CODING_UPDATE_MAX_CHARS, "Writing tests", "Task completed"]
+
+        async def stream():
+            for update in updates:
+                yield update
+
+        stream_result = MagicMock()
+        stream_result.stream = stream
+        bot.coding_agent = MagicMock()
+        bot.coding_agent.process_query = AsyncMock(return_value=stream_result)
+        bot.coding_agent.extract_update_message = lambda message: message
+        bot._send_slack_update = AsyncMock()
+
+        await bot._process_coding_query("Refactor the parser")
+
+        # The long update fills the first batch, and "completed" flushes the second one
+        sent = [call.args[0]["blocks"] for call in bot._send_slack_update.await_args_list]
+        assert [len(blocks) for blocks in sent] == [2, 2]
+        texts = [block["elements"][0]["elements"][1]["text"] for blocks in sent for block in blocks]
+        assert texts == [f" Coding update: {update}" for update in updates]
+
+    @pytest.mark.asyncio
+    async def test_coding_updates_are_sent_before_error(self, bot):
+        """Test that updates received before the stream fails reach Slack ahead of the error."""
+        import asyncio
+        from agent import CODING_UPDATE_MAX_CHARS
+
+        updates = ["Reading the code", "x" * CODING_UPDATE_MAX_CHARS, "Writing tests"]
+
+        async def stream():
+            for update in updates:
+                yield update
+            raise RuntimeError("stream broke")
+
+        stream_result = MagicMock()
+        stream_result.stream = stream
+        bot.coding_agent = MagicMock()
+        bot.coding_agent.process_query = AsyncMock(return_value=stream_result)
+        bot.coding_agent.extract_update_message = lambda message: message
+
+        posted = []
+
+        async def send(slack_message):
+            # A slow post, still in flight when the stream fails
+            await asyncio.sleep(0.01)
+            posted.append(slack_message["text"])
+
+        bot._send_slack_update = send
+
+        await bot._process_coding_query("Refactor the parser")
+
+        assert posted == ["Coding agent update", "Coding agent final update", "Coding agent error"]
+
+    @pytest.mark.asyncio
+    async def test_coding_queries_are_queued(self, bot):
+        """Test that coding queries run one at a time and excess requests are turned away."""
+        import asyncio
+        from agent import CODING_QUEUE_SIZE
+
+        processed = []
+
+        async def process(query):
+            processed.append(query)
+            await asyncio.sleep(0)
+
+        bot._process_coding_query = process
+
+        results = [await bot.call_coding_agent(f"query {i}") for i in range(CODING_QUEUE_SIZE + 1)]
+        assert all("now working" in result for result in results[:CODING_QUEUE_SIZE])
+        assert "busy" in results[-1]
+
+        await bot._coding_queue.join()
+        assert processed == [f"query {i}" for i in range(CODING_QUEUE_SIZE)]
+        bot._coding_worker_task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_hung_coding_query_times_out(self, bot, monkeypatch):
+        """Test that a coding query that never finishes doesn't block the ones behind it."""
+        import asyncio
+        import agent
+
+        monkeypatch.setattr(agent, "CODING_QUERY_TIMEOUT", 0.01)
+        processed = []
+
+        async def process(query):
+            if query == "hangs":
+                await asyncio.Event().wait()
+            processed.append(query)
+
+        bot._process_coding_query = process
+        bot._send_slack_update = AsyncMock()
+
+        await bot.call_coding_agent("hangs")
+        await bot.call_coding_agent("next")
+        await bot._coding_queue.join()
+
+        assert processed == ["next"]
+        assert bot._send_slack_update.await_args.args[0]["text"] == "Coding agent timeout"
+        bot._coding_worker_task.cancel()
@@ -52,7 +52,7 @@ def mock_morpheus_bot(populated_db):
 class TestQueryTaskDatabaseTool:
     def test_query_all_tasks(self, mock_morpheus_bot):
         """Test querying all tasks."""
-        from agent import MorpheusBot
+        from agent import MorpheusBot, _format_rows
         
         # Get the query_task_database function directly
         with patch.object(MorpheusBot, '__init__', return_value=None):
@@ -64,7 +64,7 @@ class TestQueryTaskDatabaseTool:
             def query_task_database(query, params=()):
                 try:
                     rows = bot.query_db(query, params)
-                    return "\n".join([str(row) for row in rows])
+                    return _format_rows(rows)
                 except sqlite3.Error as e:
                     return f"Error executing query: {e}"
             
@@ -79,7 +79,7 @@ class TestQueryTaskDatabaseTool:
 
     def test_query_pending_tasks(self, mock_morpheus_bot):
         """Test querying pending tasks."""
-        from agent import MorpheusBot
+        from agent import MorpheusBot, _format_rows
         
         with patch.object(MorpheusBot, '__init__', return_value=None):
             bot = MorpheusBot()
@@ -89,7 +89,7 @@ class TestQueryTaskDatabaseTool:
             def query_task_database(query, params=()):
                 try:
                     rows = bot.query_db(query, params)
-                    return "\n".join([str(row) for row in rows])
+                    return _format_rows(rows)
                 except sqlite3.Error as e:
                     return f"Error executing query: {e}"
             
@@ -105,7 +105,7 @@ class TestQueryTaskDatabaseTool:
 
     def test_query_with_params(self, mock_morpheus_bot):
         """Test querying with parameters."""
-        from agent import MorpheusBot
+        from agent import MorpheusBot, _format_rows
         
         with patch.object(MorpheusBot, '__init__', return_value=None):
             bot = MorpheusBot()
@@ -115,7 +115,7 @@ class TestQueryTaskDatabaseTool:
             def query_task_database(query, params=()):
                 try:
                     rows = bot.query_db(query, params)
-                    return "\n".join([str(row) for row in rows])
+                    return _format_rows(rows)
                 except sqlite3.Error as e:
                     return f"Error executing query: {e}"
             
@@ -130,7 +130,7 @@ class TestQueryTaskDatabaseTool:
 
     def test_error_handling(self, mock_morpheus_bot):
         """Test error handling for invalid queries."""
-        from agent import MorpheusBot
+        from agent import MorpheusBot, _format_rows
         
         with patch.object(MorpheusBot, '__init__', return_value=None):
             bot = MorpheusBot()
@@ -140,10 +140,59 @@ class TestQueryTaskDatabaseTool:
             def query_task_database(query, params=()):
                 try:
                     rows = bot.query_db(query, params)
-                    return "\n".join([str(row) for row in rows])
+                    return _format_rows(rows)
                 except sqlite3.Error as e:
                     return f"Error executing query: {e}"
             
             # This should return an error message
             result = query_task_database("INVALID SQL")
-            assert "Error executing query" in result
\ No newline at end of file
+            assert "Error executing query" in result
+
+    def test_rows_are_tab_separated(self, mock_morpheus_bot):
+        """Test that result rows are rendered as tab-separated values, one row per line."""
+        from agent import _format_rows
+
+        rows = mock_morpheus_bot.query_db(
+            "SELECT id, description, tags, recurrence, time_complete FROM tasks ORDER BY id LIMIT 2"
+        )
+        assert _format_rows(rows) == (
+            "1\tTask 1: Complete project review\twork,project,review\t\tNone\n"
+            "2\tTask 2: Weekly planning session\tplanning,weekly\tweekly\tNone"
+        )
+        assert _format_rows([]) == ""
+
+    def test_rows_with_line_breaks_are_quoted(self):
+        """Test that values containing tabs or line breaks can't be read as extra columns or rows."""
+        from agent import _format_rows
+
+        rows = [(1, "Buy milk\nand bread", "home\tshopping"), (2, "Call mom", "")]
+        assert _format_rows(rows) == (
+            "1\t'Buy milk\\nand bread'\t'home\\tshopping'\n"
+            "2\tCall mom\t"
+        )
+
+    def test_repeated_select_is_cached(self, populated_db):
+        """Test that an identical SELECT within a turn is served from the cache until a write."""
+        from agent import MorpheusBot
+
+        with patch.object(MorpheusBot, '__init__', return_value=None):
+            bot = MorpheusBot()
+            bot._select_cache = {}
+            bot._tasks_version = 0
+            bot._tasks_state = lambda: bot._tasks_version
+            bot.query_db = MagicMock(side_effect=lambda query, params=(): populated_db.execute(query, params).fetchall())
+
+            query = "SELECT description FROM tasks WHERE tags LIKE ?"
+            first = bot.query_task_database(query, ("%planning%",))
+            assert bot.query_task_database(query, ("%planning%",)) == first
+            assert bot.query_db.call_count == 1
+
+            # A write changes the tasks state, so the query runs again
+            bot._tasks_version += 1
+            bot.query_task_database(query, ("%planning%",))
+            assert bot.query_db.call_count == 2
+
+            # A new turn starts with an empty cache
+            bot.reset_turn_cache()
+            bot.query_task_database(query, ("%planning%",))
+            assert bot.query_db.call_count == 3
@@ -30,6 +30,8 @@ def mock_morpheus_bot():
 class TestErrorHandling:
     def test_database_connection_error(self, mock_morpheus_bot):
         """Test handling database connection errors."""
+        from agent import _format_rows
+
         # Set up the mock to raise a connection error
         mock_morpheus_bot.query_db.side_effect = sqlite3.OperationalError("unable to open database file")
         
@@ -37,7 +39,7 @@ class TestErrorHandling:
         def query_task_database(query, params=()):
             try:
                 rows = mock_morpheus_bot.query_db(query, params)
-                return "\n".join([str(row) for row in rows])
+                return _format_rows(rows)
             except sqlite3.Error as e:
                 return f"Error executing query: {e}"
                 
@@ -53,6 +55,8 @@ class TestErrorHandling:
 
     def test_invalid_sql_query(self, mock_morpheus_bot):
         """Test handling invalid SQL queries."""
+        from agent import _format_rows
+
         # Set up the mock to raise a syntax error
         mock_morpheus_bot.query_db.side_effect = sqlite3.OperationalError("near 'INVALID': syntax error")
         
@@ -60,7 +64,7 @@ class TestErrorHandling:
         def query_task_database(query, params=()):
             try:
                 rows = mock_morpheus_bot.query_db(query, params)
-                return "\n".join([str(row) for row in rows])
+                return _format_rows(rows)
             except sqlite3.Error as e:
                 return f"Error executing query: {e}"
                 
@@ -126,6 +130,8 @@ class TestErrorHandling:
 
     def test_empty_task_database(self, mock_morpheus_bot):
         """Test handling an empty task database."""
+        from agent import _format_rows
+
         # Configure the query_db to return an empty list
         mock_morpheus_bot.query_db.return_value = []
         
@@ -133,7 +139,7 @@ class TestErrorHandling:
         def query_task_database(query, params=()):
             try:
                 rows = mock_morpheus_bot.query_db(query, params)
-                return "\n".join([str(row) for row in rows])
+                return _format_rows(rows)
             except sqlite3.Error as e:
                 return f"Error executing query: {e}"
                 
@@ -221,7 +227,7 @@ class TestEdgeCases:
         
         # Set history with a timestamp
         mock_morpheus_bot.history = ["test message"]
-        mock_morpheus_bot.history_timestamp = time.time() - 3601  # 1 hour + 1 second ago
+        mock_morpheus_bot.history_timestamp = time.monotonic() - 3601  # 1 hour + 1 second ago
         
         # Patch the get_history method to use our mock
         from agent import MorpheusBot
@@ -0,0 +1,78 @@
+"""
+Unit tests for trimming the conversation history kept between turns.
+"""
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+
+def _turn(n, with_tool_call=False):
+    """Build the messages of one conversation turn."""
+    messages = [ModelRequest(parts=[UserPromptPart(content=f"question {n}")])]
+    if with_tool_call:
+        messages.append(ModelResponse(parts=[ToolCallPart(tool_name="query_task_database", tool_call_id=str(n))]))
+        messages.append(ModelRequest(parts=[ToolReturnPart(tool_name="query_task_database", content="", tool_call_id=str(n))]))
+    messages.append(ModelResponse(parts=[TextPart(content=f"answer {n}")]))
+    return messages
+
+
+class TestTrimHistory:
+    def test_short_history_is_unchanged(self):
+        """Test that a history within the limit is returned as is."""
+        from agent import _trim_history
+
+        messages = _turn(1) + _turn(2)
+        assert _trim_history(messages, max_messages=4) is messages
+
+    def test_trims_at_turn_boundary(self):
+        """Test that whole turns are dropped and the system prompt is kept."""
+        from agent import _trim_history
+
+        messages = _turn(1) + _turn(2, with_tool_call=True) + _turn(3)
+        messages[0].parts.insert(0, SystemPromptPart(content="You are Morpheus."))
+
+        # The last 5 messages start in the middle of turn 2, so the cut moves forward to turn 3
+        trimmed = _trim_history(messages, max_messages=5)
+        assert len(trimmed) == 2
+        assert [type(part) for part in trimmed[0].parts] == [SystemPromptPart, UserPromptPart]
+        assert trimmed[0].parts[1].content == "question 3"
+        assert trimmed[1] is messages[-1]
+        # The original first message is left untouched
+        assert len(messages[0].parts) == 2
+
+    def test_single_long_turn_is_kept(self):
+        """Test that a history without a safe cut point is not trimmed."""
+        from agent import _trim_history
+
+        messages = _turn(1, with_tool_call=True)
+        assert _trim_history(messages, max_messages=2) is messages
+
+    def test_trims_to_character_budget(self):
+        """Test that old turns are dropped once the history grows past the size budget."""
+        from agent import _trim_history
+
+        messages = _turn(1) + _turn(2) + _turn(3)
+        messages[1].parts[0].content = "x" * 1000
+
+        # Turn 1 alone is over budget; turns 2 and 3 fit
+        trimmed = _trim_history(messages, max_chars=100)
+        assert [msg.parts[0].content for msg in trimmed] == ["question 2", "answer 2", "question 3", "answer 3"]
+
+        # When even the last turn is too large, only that turn is kept
+        trimmed = _trim_history(messages, max_chars=5)
+        assert [msg.parts[0].content for msg in trimmed] == ["question 3", "answer 3"]
+
+    def test_system_prompt_is_not_counted(self):
+        """Test that a large system prompt doesn't use up the size budget of the turns."""
+        from agent import _trim_history
+
+        messages = _turn(1) + _turn(2)
+        messages[0].parts.insert(0, SystemPromptPart(content="x" * 25000))
+
+        assert _trim_history(messages, max_chars=24000) is messages
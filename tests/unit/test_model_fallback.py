@@ -0,0 +1,158 @@
+"""
+Unit tests for the model wrappers: fallback errors, the circuit breaker and prompt caching.
+"""
+from unittest.mock import patch
+
+import anthropic
+import httpx
+import openai
+import pytest
+
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.models import Model
+
+
+class TestModelFallback:
+    @pytest.mark.parametrize("status_code,expected", [
+        (429, True),
+        (500, True),
+        (503, True),
+        (529, True),
+        (400, False),
+        (401, False),
+        (404, False),
+    ])
+    def test_http_errors(self, status_code, expected):
+        """Test that only retryable status codes move on to the next model."""
+        from agent import _should_fall_back
+
+        exc = ModelHTTPError(status_code=status_code, model_name="claude-3-5-sonnet-latest")
+        assert _should_fall_back(exc) is expected
+
+    def test_connection_errors(self):
+        """Test that connection errors and timeouts from either provider fall back."""
+        from agent import _should_fall_back
+
+        request = httpx.Request("POST", "https://api.example.com")
+        assert _should_fall_back(anthropic.APIConnectionError(request=request))
+        assert _should_fall_back(openai.APITimeoutError(request=request))
+
+    def test_other_errors(self):
+        """Test that unrelated errors are raised instead of falling back."""
+        from agent import _should_fall_back
+
+        assert not _should_fall_back(ValueError("bad tool arguments"))
+
+
+class _FlakyModel(Model):
+    """Model stub that raises the queued errors in order, then succeeds."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def request(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "response"
+
+    @property
+    def model_name(self):
+        return "flaky"
+
+    @property
+    def system(self):
+        return "test"
+
+
+class TestCircuitBreakerModel:
+    @pytest.mark.asyncio
+    async def test_opens_after_repeated_failures(self):
+        """Test that the circuit opens after the failure threshold and skips the model."""
+        from agent import CircuitBreakerModel, ProviderDown, _should_fall_back
+
+        model = _FlakyModel([ModelHTTPError(503, "flaky")] * 3)
+        breaker = CircuitBreakerModel(model, failure_threshold=3, reset_timeout=30)
+
+        for _ in range(3):
+            with pytest.raises(ModelHTTPError):
+                await breaker.request()
+        with pytest.raises(ProviderDown) as exc_info:
+            await breaker.request()
+        assert model.calls == 3
+        assert _should_fall_back(exc_info.value)
+
+    @pytest.mark.asyncio
+    async def test_half_open_probe(self):
+        """Test that one probe is let through after the reset timeout and closes the circuit."""
+        from agent import CircuitBreakerModel, ProviderDown
+
+        model = _FlakyModel([ModelHTTPError(503, "flaky")] * 2)
+        breaker = CircuitBreakerModel(model, failure_threshold=1, reset_timeout=30)
+
+        with patch("time.monotonic", return_value=100.0):
+            with pytest.raises(ModelHTTPError):
+                await breaker.request()
+
+        # A failed probe keeps the circuit open
+        with patch("time.monotonic", return_value=131.0):
+            with pytest.raises(ModelHTTPError):
+                await breaker.request()
+        with patch("time.monotonic", return_value=140.0):
+            with pytest.raises(ProviderDown):
+                await breaker.request()
+
+        # A successful probe closes it again
+        with patch("time.monotonic", return_value=162.0):
+            assert await breaker.request() == "response"
+        assert await breaker.request() == "response"
+        assert model.calls == 4
+
+    @pytest.mark.asyncio
+    async def test_request_errors_do_not_count(self):
+        """Test that non-retryable errors never open the circuit."""
+        from agent import CircuitBreakerModel
+
+        model = _FlakyModel([ModelHTTPError(400, "flaky")] * 3)
+        breaker = CircuitBreakerModel(model, failure_threshold=2)
+
+        for _ in range(3):
+            with pytest.raises(ModelHTTPError):
+                await breaker.request()
+        assert await breaker.request() == "response"
+
+
+class TestCachingAnthropicModel:
+    @pytest.mark.asyncio
+    async def test_system_prompt_is_cached(self):
+        """Test that the system prompt is sent as one text block with a cache breakpoint."""
+        from agent import CachingAnthropicModel
+        from pydantic_ai.messages import ModelRequest, SystemPromptPart, UserPromptPart
+        from pydantic_ai.providers.anthropic import AnthropicProvider
+
+        model = CachingAnthropicModel("claude-3-5-haiku-latest", provider=AnthropicProvider(api_key="test"))
+        system, messages = await model._map_message([
+            ModelRequest(parts=[
+                SystemPromptPart(content="You are Morpheus."),
+                SystemPromptPart(content="The current date is today."),
+                UserPromptPart(content="Hello"),
+            ]),
+        ])
+        assert system == [{
+            "type": "text",
+            "text": "You are Morpheus.\n\nThe current date is today.",
+            "cache_control": {"type": "ephemeral"},
+        }]
+        assert len(messages) == 1
+
+    @pytest.mark.asyncio
+    async def test_no_system_prompt(self):
+        """Test that requests without a system prompt are left unchanged."""
+        from agent import CachingAnthropicModel
+        from pydantic_ai.messages import ModelRequest, UserPromptPart
+        from pydantic_ai.providers.anthropic import AnthropicProvider
+
+        model = CachingAnthropicModel("claude-3-5-haiku-latest", provider=AnthropicProvider(api_key="test"))
+        system, _ = await model._map_message([ModelRequest(parts=[UserPromptPart(content="Hello")])])
+        assert system == ""
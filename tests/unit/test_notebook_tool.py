@@ -97,4 +97,81 @@ class TestWriteNotesToNotebookTool:
             
             # This should return an error message
             result = write_notes_to_notebook("This will fail")
-            assert "Error writing to notebook" in result
\ No newline at end of file
+            assert "Error writing to notebook" in result
+
+    def test_flush_buffered_notes(self, mock_morpheus_bot, temp_notebook_file):
+        """Test that buffered notes are appended to the notebook in order on flush."""
+        from agent import MorpheusBot
+
+        with patch.object(MorpheusBot, '__init__', return_value=None):
+            bot = MorpheusBot()
+            bot.notes_dir = mock_morpheus_bot.notes_dir
+            bot.notebook_filename = mock_morpheus_bot.notebook_filename
+            bot._pending_notes = ["First note", "Second note"]
+
+            bot.flush_notes()
+
+            # The buffer is emptied and both notes land in the file
+            assert bot._pending_notes == []
+            content = temp_notebook_file.read_text()
+            assert content.endswith("First note\nSecond note\n")
+
+    def test_flush_handles_short_writes(self, mock_morpheus_bot, temp_notebook_file):
+        """Test that the whole batch is written even when os.write writes only part of it."""
+        from agent import MorpheusBot
+
+        real_write = os.write
+        with patch.object(MorpheusBot, '__init__', return_value=None), \
+             patch('os.write', side_effect=lambda fd, data: real_write(fd, data[:5])):
+            bot = MorpheusBot()
+            bot.notes_dir = mock_morpheus_bot.notes_dir
+            bot.notebook_filename = mock_morpheus_bot.notebook_filename
+            bot._pending_notes = ["First note", "Second note"]
+
+            bot.flush_notes()
+
+            assert temp_notebook_file.read_text().endswith("First note\nSecond note\n")
+
+    def test_flush_failure_keeps_notes(self, mock_morpheus_bot, temp_notebook_file, tmp_path):
+        """Test that notes are kept for the next flush when writing the notebook fails."""
+        from agent import MorpheusBot
+
+        with patch.object(MorpheusBot, '__init__', return_value=None):
+            bot = MorpheusBot()
+            bot.notes_dir = str(tmp_path / "missing")
+            bot.notebook_filename = mock_morpheus_bot.notebook_filename
+            bot._pending_notes = ["First note", "Second note"]
+
+            with pytest.raises(OSError):
+                bot.flush_notes()
+            assert bot._pending_notes == ["First note", "Second note"]
+
+            # Notes written while the notebook was unavailable follow the retried ones
+            bot._pending_notes.append("Third note")
+            bot.notes_dir = mock_morpheus_bot.notes_dir
+            bot._notes_cache = None
+            bot.flush_notes()
+            assert bot._pending_notes == []
+            assert temp_notebook_file.read_text().endswith("First note\nSecond note\nThird note\n")
+
+    def test_notes_prompt_cache(self, mock_morpheus_bot, temp_notebook_file):
+        """Test that the notebook prompt is cached until the notebook changes."""
+        from agent import MorpheusBot
+
+        with patch.object(MorpheusBot, '__init__', return_value=None):
+            bot = MorpheusBot()
+            bot.notes_dir = mock_morpheus_bot.notes_dir
+            bot.notebook_filename = mock_morpheus_bot.notebook_filename
+            bot._notes_cache = None
+            bot._pending_notes = []
+
+            prompt = bot._notes_prompt()
+            assert prompt.endswith(temp_notebook_file.read_text())
+
+            # An unchanged file is served from the cache without reading it
+            with patch('builtins.open', side_effect=AssertionError("notebook was re-read")):
+                assert bot._notes_prompt() == prompt
+
+            bot._pending_notes = ["A new note"]
+            bot.flush_notes()
+            assert bot._notes_prompt().endswith("A new note\n")
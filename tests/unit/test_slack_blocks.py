@@ -0,0 +1,36 @@
+"""
+Unit tests for building Slack blocks from agent messages.
+"""
+from pydantic_ai.messages import ModelResponse, ModelRequest, TextPart, ToolCallPart, ToolReturnPart
+
+
+class TestSlackBlocks:
+    def test_message_block(self):
+        """Test that text and tool call parts become rich text elements in order."""
+        from agent import _message_block
+
+        msg = ModelResponse(parts=[
+            TextPart(content="Let me check."),
+            ToolCallPart(tool_name="query_task_database", args={"query": "SELECT * FROM tasks"}),
+            TextPart(content=""),
+        ])
+        assert _message_block(msg) == {
+            "type": "rich_text",
+            "elements": [{
+                "type": "rich_text_section",
+                "elements": [
+                    {"type": "text", "text": "Let me check.\n"},
+                    {"type": "emoji", "name": "mag"},
+                    {"type": "text", "text": " Called query_task_database\n"},
+                ],
+            }],
+        }
+
+    def test_unshown_parts_are_skipped(self):
+        """Test that parts without a builder, like tool returns, produce no elements."""
+        from agent import _message_block
+
+        msg = ModelRequest(parts=[
+            ToolReturnPart(tool_name="query_task_database", content="1\tTask", tool_call_id="1"),
+        ])
+        assert _message_block(msg)["elements"][0]["elements"] == []
@@ -0,0 +1,40 @@
+"""
+Unit tests for choosing the Slack emoji shown for tool calls.
+"""
+import pytest
+
+from pydantic_ai.messages import ToolCallPart
+
+
+class TestToolCallEmoji:
+    @pytest.mark.parametrize("query,emoji", [
+        ("SELECT * FROM tasks", "mag"),
+        ("  insert into tasks (description) VALUES ('x')", "heavy_plus_sign"),
+        ("UPDATE tasks SET due = '' WHERE id = 1", "pencil"),
+        ("DELETE FROM tasks WHERE id = 1", "wastebasket"),
+        ("PRAGMA table_info(tasks)", "card_index_dividers"),
+    ])
+    def test_query_emoji_from_dict_args(self, query, emoji):
+        """Test that the SQL statement type in the query argument picks the emoji."""
+        from agent import _tool_call_emoji
+
+        part = ToolCallPart(tool_name="query_task_database", args={"query": query})
+        assert _tool_call_emoji(part) == emoji
+
+    def test_query_emoji_from_json_args(self):
+        """Test that arguments sent as a JSON string are parsed."""
+        from agent import _tool_call_emoji
+
+        part = ToolCallPart(
+            tool_name="query_task_database",
+            args='{"query": "SELECT id FROM tasks", "params": []}',
+        )
+        assert _tool_call_emoji(part) == "mag"
+
+    def test_other_tools(self):
+        """Test emoji for the remaining tools and unknown tools."""
+        from agent import _tool_call_emoji
+
+        assert _tool_call_emoji(ToolCallPart(tool_name="write_notes_to_notebook", args={"text": "x"})) == "memo"
+        assert _tool_call_emoji(ToolCallPart(tool_name="call_coding_agent", args={"query": "x"})) == "robot_face"
+        assert _tool_call_emoji(ToolCallPart(tool_name="run_python_code", args={"python_code": "1"})) == "gear"